@@ -1,13 +1,20 @@
+import hashlib
+import io
+import os
+import tempfile
+import time
+
 import streamlit as st
 import pandas as pd
 import numpy as np
+import duckdb
+import pyarrow as pa
+import pyarrow.compute as pc
 import seaborn as sns
 import matplotlib.pyplot as plt
-from sklearn.preprocessing import MinMaxScaler
 
 import folium
 from folium.plugins import HeatMap
-from streamlit_folium import st_folium
 
 # ---------------- Page Config ----------------
 st.set_page_config(
@@ -29,14 +36,113 @@ if uploaded_file is None:
     st.stop()
 
 # ---------------- Load Data ----------------
-df = pd.read_csv(uploaded_file)
+exclude_cols = ["year", "state_name", "district_name", "registration_circles", "lat", "lon"]
+cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache")
+# Bump the version whenever the preprocessing below changes
+cache_prefix = "google-heatmaps-v1"
+cache_max_files = 20
+
+
+def prune_cache() -> None:
+    """Keep only the most recently used Parquet files and drop stale temp files."""
+    now = time.time()
+    paths = [os.path.join(cache_dir, f) for f in os.listdir(cache_dir)]
+
+    # Temp files older than an hour belong to writes that were killed
+    for path in paths:
+        if path.endswith(".tmp") and now - os.path.getmtime(path) > 3600:
+            os.remove(path)
+
+    parquet_paths = sorted(
+        (path for path in paths if path.endswith(".parquet")),
+        key=os.path.getmtime,
+        reverse=True
+    )
+    for path in parquet_paths[cache_max_files:]:
+        os.remove(path)
+
+
+@st.cache_data(show_spinner=False)
+def load_and_prep(
+    data_key: str, _file_bytes: bytes
+) -> tuple[pd.DataFrame, list, dict]:
+    """Parse and clean the uploaded CSV; cached on its content hash.
+
+    Also returns the sorted years and a year -> sorted states lookup so the
+    sidebar never has to scan the full frame.
+    """
+    # Converted uploads are kept as Parquet, which reloads far faster than CSV
+    parquet_path = os.path.join(
+        cache_dir, f"{cache_prefix}-{data_key}.parquet"
+    )
+
+    if os.path.exists(parquet_path):
+        df = pd.read_parquet(parquet_path, engine="pyarrow")
+        # Mark it as recently used so pruning evicts older uploads first
+        try:
+            os.utime(parquet_path)
+        except OSError:
+            pass
+    else:
+        df = pd.read_csv(
+            io.BytesIO(_file_bytes),
+            engine="pyarrow"
+        )
+
+        # ---------------- Preprocessing ----------------
+        df.columns = df.columns.str.strip().str.lower()
+
+        # Forward fill the key columns, then store the repeated strings as
+        # categories for cheaper filtering/grouping. Arrow-backed strings
+        # already ffill in Arrow; object columns (older pandas) go through
+        # pyarrow.compute explicitly
+        key_cols = ["state_name", "district_name"]
+        for c in key_cols:
+            if df[c].dtype == object:
+                df[c] = pc.fill_null_forward(
+                    pa.array(df[c], from_pandas=True)
+                ).to_numpy(zero_copy_only=False)
+            else:
+                df[c] = df[c].ffill()
+        df[key_cols] = df[key_cols].astype("category")
+
+        crime_cols = [c for c in df.columns if c not in exclude_cols]
+        # Counts are small whole numbers, so float32 is exact and halves the bytes
+        df[crime_cols] = df[crime_cols].apply(
+            pd.to_numeric, errors="coerce"
+        ).fillna(0).astype(np.float32)
+
+        # Write to a temp file and swap it in, so a crash or a concurrent
+        # session never leaves a partial file; a read-only deploy just skips it
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+            os.close(fd)
+            try:
+                df.to_parquet(tmp_path, engine="pyarrow")
+                os.replace(tmp_path, parquet_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            prune_cache()
+        except OSError:
+            pass
+
+    year_to_states = {
+        y: sorted(g["state_name"].unique().tolist())
+        for y, g in df.groupby("year", sort=False)
+    }
+    years = sorted(year_to_states)
+
+    # Sorted (year, state) index lets selections slice by binary search
+    df = df.set_index(["year", "state_name"]).sort_index()
 
-# ---------------- Preprocessing ----------------
-df.columns = df.columns.str.strip().str.lower()
+    return df, years, year_to_states
 
-# Forward fill important columns
-df["state_name"] = df["state_name"].ffill()
-df["district_name"] = df["district_name"].ffill()
+
+file_bytes = uploaded_file.getvalue()
+data_key = hashlib.sha1(file_bytes).hexdigest()
+df, years, year_to_states = load_and_prep(data_key, file_bytes)
 
 # Required columns check
 required_columns = {"lat", "lon"}
@@ -45,42 +151,87 @@ if not required_columns.issubset(df.columns):
     st.stop()
 
 # Identify crime columns
-exclude_cols = ["year", "state_name", "district_name", "registration_circles", "lat", "lon"]
 crime_cols = [c for c in df.columns if c not in exclude_cols]
 
-df[crime_cols] = df[crime_cols].apply(
-    pd.to_numeric, errors="coerce"
-).fillna(0)
-
 # ---------------- Sidebar Filters ----------------
 st.sidebar.header("🎯 Filters")
 
-years = sorted(df["year"].dropna().unique())
 selected_year = st.sidebar.selectbox("Select Year", years)
 
-states = sorted(df[df["year"] == selected_year]["state_name"].unique())
+states = year_to_states[selected_year]
 selected_state = st.sidebar.selectbox("Select State", states)
 
-# ---------------- Filter Data ----------------
-filtered_df = df[
-    (df["year"] == selected_year) &
-    (df["state_name"] == selected_state)
-]
 
-# ---------------- Aggregate District Data ----------------
-district_df = filtered_df.groupby(
-    ["district_name", "lat", "lon"],
-    as_index=False
-)[crime_cols].sum()
+@st.cache_resource
+def get_duck():
+    """DuckDB connection shared across reruns and sessions."""
+    return duckdb.connect()
+
+
+@st.cache_data(show_spinner=False)
+def get_district_df(year, state, data_key: str, _df) -> pd.DataFrame:
+    """District totals and crime index for one (year, state) selection.
+
+    Memoised on ``data_key`` (the upload's content hash), so each selection
+    is aggregated once and revisiting it skips the pandas/DuckDB work.
+    """
+    # ---------------- Filter Data ----------------
+    filtered_df = _df.loc[[(year, state)]].reset_index()
 
-# ---------------- Crime Index ----------------
-district_df["total_crime"] = district_df[crime_cols].sum(axis=1)
+    # ---------------- Aggregate District Data ----------------
+    # A cursor per call keeps concurrent sessions off each other's views
+    con = get_duck().cursor()
+    con.register("crimes", filtered_df)
 
-scaler = MinMaxScaler()
-district_df["crime_index"] = scaler.fit_transform(
-    district_df[["total_crime"]]
+    # Column names come from the uploaded header, so quote each one as an
+    # identifier (doubling embedded quotes) before it goes into the SQL
+    quoted_cols = ['"' + c.replace('"', '""') + '"' for c in crime_cols]
+    sum_cols_sql = ", ".join(
+        f"CAST(SUM({q}) AS FLOAT) AS {q}" for q in quoted_cols
+    )
+    district_df = con.execute(f"""
+        SELECT district_name, lat, lon, {sum_cols_sql}
+        FROM crimes
+        WHERE lat IS NOT NULL AND lon IS NOT NULL
+        GROUP BY district_name, lat, lon
+        ORDER BY district_name, lat, lon
+    """).df()
+    con.close()
+
+    # Only observed districts: the ENUM comes back carrying every district
+    # in the dataset, which would bloat each cached copy and payload
+    district_df["district_name"] = (
+        district_df["district_name"].cat.remove_unused_categories()
+    )
+
+    # Nothing to index (e.g. every row lacks coordinates); the caller stops
+    if district_df.empty:
+        return district_df
+
+    # ---------------- Crime Index ----------------
+    arr = district_df[crime_cols].to_numpy(copy=False)
+    district_df["total_crime"] = arr.sum(axis=1, dtype=np.float32)
+
+    t = district_df["total_crime"].to_numpy()
+    lo = t.min()
+    hi = t.max()
+    rng = hi - lo or 1.0
+    district_df["crime_index"] = (t - lo) / rng
+
+    return district_df
+
+
+district_df = get_district_df(
+    selected_year,
+    selected_state,
+    data_key,
+    df
 )
 
+if district_df.empty:
+    st.warning("No districts with coordinates available for this selection.")
+    st.stop()
+
 # ---------------- Display Table ----------------
 st.subheader(
     f"📍 {selected_state} – District-wise Crime Data ({selected_year})"
@@ -92,77 +243,158 @@ st.dataframe(district_df)
 # =========================================================
 st.subheader("🔥 Crime Heatmap (Table View)")
 
-heatmap_cols = crime_cols + ["total_crime"]
 
-heatmap_data = district_df.set_index("district_name")[heatmap_cols]
+@st.cache_data(show_spinner=False)
+def heatmap_png(
+    year, state, data_key: str, _values: np.ndarray, _index, _columns
+) -> bytes:
+    """Render the district x crime heatmap to PNG bytes.
 
-if heatmap_data.empty:
-    st.warning("No crime data available.")
-else:
+    The matrix arguments are left unhashed; together with the year and state,
+    ``data_key`` (the upload's content hash) identifies them.
+    """
     fig, ax = plt.subplots(
-        figsize=(12, max(6, len(heatmap_data) * 0.35))
-    )
-    sns.heatmap(
-        heatmap_data,
-        cmap="Reds",
-        linewidths=0.5,
-        ax=ax
+        figsize=(12, max(6, len(_index) * 0.35))
     )
+    # Wide matrices draw one image instead of a rectangle patch per cell
+    if _values.size > 5000:
+        im = ax.imshow(_values, aspect="auto", cmap="Reds")
+        ax.set_xticks(range(len(_columns)))
+        ax.set_xticklabels(_columns, rotation=90)
+        ax.set_yticks(range(len(_index)))
+        ax.set_yticklabels(_index)
+        fig.colorbar(im, ax=ax)
+    else:
+        sns.heatmap(
+            pd.DataFrame(_values, index=_index, columns=_columns),
+            cmap="Reds",
+            linewidths=0.5,
+            ax=ax
+        )
     ax.set_xlabel("Crime Type")
     ax.set_ylabel("District")
     ax.set_title(
-        f"Crime Heatmap – {selected_state} ({selected_year})"
+        f"Crime Heatmap – {state} ({year})"
+    )
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", dpi=100, bbox_inches="tight")
+    plt.close(fig)
+    return buf.getvalue()
+
+
+heatmap_cols = crime_cols + ["total_crime"]
+
+heatmap_data = district_df.set_index("district_name")[heatmap_cols]
+
+if heatmap_data.empty:
+    st.warning("No crime data available.")
+else:
+    st.image(
+        heatmap_png(
+            selected_year,
+            selected_state,
+            data_key,
+            heatmap_data.to_numpy(),
+            heatmap_data.index.tolist(),
+            heatmap_data.columns.tolist()
+        )
     )
-    st.pyplot(fig)
 
 # =========================================================
 # 🗺️ HEATMAP 2: GOOGLE MAPS STYLE (FOLIUM)
 # =========================================================
 st.subheader("🗺️ Crime Heatmap on Map (Google Maps Style)")
 
-# Prepare map data [lat, lon, intensity]
-map_data = district_df[
-    ["lat", "lon", "crime_index"]
-].values.tolist()
 
-center_lat = district_df["lat"].mean()
-center_lon = district_df["lon"].mean()
+@st.cache_data(show_spinner=False)
+def build_map_html(year, state, payload: bytes) -> str:
+    """Render the folium map for one selection to standalone HTML.
 
-m = folium.Map(
-    location=[center_lat, center_lon],
-    zoom_start=6,
-    tiles="CartoDB positron"  # Clean Google-like map
-)
+    ``payload`` is the JSON-encoded district table, so the cached page is
+    reused across reruns that don't change the selection.
+    """
+    map_df = pd.read_json(io.StringIO(payload.decode()), orient="split")
+
+    # Prepare map data [lat, lon, intensity]
+    # 5 decimals (~1 m) is plenty for display and keeps the page JSON small
+    map_data = np.round(
+        map_df[["lat", "lon", "crime_index"]].to_numpy(dtype=np.float64),
+        5
+    )
+
+    center_lat = map_df["lat"].mean()
+    center_lon = map_df["lon"].mean()
+
+    m = folium.Map(
+        location=[center_lat, center_lon],
+        zoom_start=6,
+        tiles="CartoDB positron"  # Clean Google-like map
+    )
 
-HeatMap(
-    map_data,
-    radius=30,
-    blur=25,
-    min_opacity=0.4,
-    gradient={
-        0.2: "blue",
-        0.4: "lime",
-        0.6: "orange",
-        0.8: "red"
+    HeatMap(
+        map_data,
+        radius=30,
+        blur=25,
+        min_opacity=0.4,
+        gradient={
+            0.2: "blue",
+            0.4: "lime",
+            0.6: "orange",
+            0.8: "red"
+        }
+    ).add_to(m)
+
+    # Optional district markers (one GeoJSON layer instead of a marker per district)
+    lat = map_df["lat"].to_numpy()
+    lon = map_df["lon"].to_numpy()
+    name = map_df["district_name"].to_numpy()
+    tot = map_df["total_crime"].to_numpy(np.int64)
+    idx = map_df["crime_index"].to_numpy()
+
+    district_fc = {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "type": "Feature",
+                "geometry": {
+                    "type": "Point",
+                    "coordinates": [round(float(lo), 5), round(float(la), 5)]
+                },
+                "properties": {
+                    "district_name": str(n),
+                    "total_crime": int(t),
+                    "crime_index": round(float(i), 2)
+                }
+            }
+            for la, lo, n, t, i in zip(lat, lon, name, tot, idx)
+        ]
     }
-).add_to(m)
-
-# Optional district markers
-for _, row in district_df.iterrows():
-    folium.CircleMarker(
-        location=[row["lat"], row["lon"]],
-        radius=4,
-        popup=f"""
-        <b>{row['district_name']}</b><br>
-        Total Crime: {int(row['total_crime'])}<br>
-        Crime Index: {row['crime_index']:.2f}
-        """,
-        color="red",
-        fill=True,
-        fill_opacity=0.7
+
+    folium.GeoJson(
+        district_fc,
+        marker=folium.CircleMarker(
+            radius=4,
+            color="red",
+            fill=True,
+            fill_opacity=0.7
+        ),
+        popup=folium.GeoJsonPopup(
+            fields=["district_name", "total_crime", "crime_index"],
+            aliases=["District", "Total Crime", "Crime Index"]
+        )
     ).add_to(m)
 
-st_folium(m, width=1200, height=600)
+    return m.get_root().render()
+
+
+map_cols = ["district_name", "lat", "lon", "total_crime", "crime_index"]
+map_html = build_map_html(
+    selected_year,
+    selected_state,
+    district_df[map_cols].to_json(orient="split").encode()
+)
+st.iframe(map_html, width=1200, height=600)
 
 # =========================================================
 # 📈 TOP DISTRICTS
@@ -176,10 +408,12 @@ top_n = st.slider(
     value=10
 )
 
-top_districts = district_df.sort_values(
-    "crime_index",
-    ascending=False
-).head(top_n)
+# Partial selection of the top_n instead of sorting every district
+ci = district_df["crime_index"].to_numpy()
+k = min(top_n, len(ci))
+idx = np.argpartition(-ci, k - 1)[:k]
+idx = idx[np.argsort(-ci[idx])]
+top_districts = district_df.iloc[idx]
 
 st.dataframe(
     top_districts[